@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 import argparse
-import pickle
+import lxml.html
+import os
 import random
 import re
 import requests
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from math import radians, sin, cos, sqrt, asin, log2
 import matplotlib.pyplot as plt
+import numpy as np
+from numba import njit, prange
+from requests_cache import CachedSession
 
 ##############################
 # Loggers
@@ -29,27 +35,54 @@ def info(*args):
 ##############################
 # Crawl neccessary information
 ##############################
+# All wikipedia fetches go through one Session, so the TLS connection is
+# kept alive between requests instead of a fresh handshake per page. The
+# session also caches responses on disk for a day, so reparsing (e.g. after
+# a parser fix) does not re-download every page
+_session = CachedSession('resources/wiki_cache', backend='sqlite', expire_after=86400)
+_session.mount('https://', requests.adapters.HTTPAdapter(
+    pool_connections=8, pool_maxsize=16, max_retries=3))
+_session.headers['User-Agent'] = 'PSZT-America/1.0 (university project)'
+
+@njit(cache=True, fastmath=True)
+def _hav(lat1: float, lon1: float, cos_lat1: float,
+         lat2: float, lon2: float, cos_lat2: float) -> float:
+    '''
+        Scalar Haversine distance in kilometers between two points given in
+        radians, with the cosines of the latitudes precomputed by the caller
+    '''
+    s1 = sin((lat2 - lat1) * 0.5)
+    s2 = sin((lon2 - lon1) * 0.5)
+    a = s1 * s1 + cos_lat1 * cos_lat2 * s2 * s2
+    # 12742 km = earth diameter (2 * 6371), folded into one constant
+    return 12742.0 * asin(sqrt(a))
+
 class Capital:
+    __slots__ = ('name', 'lat', 'lon', 'cos_lat')
+
+    # Matches one DMS coordinate (degrees, minutes, optional seconds plus
+    # the hemisphere letter); compiled once at class scope
+    _DMS_RE = re.compile(r'(\d+)\D+(\d+)\D+(?:(\d+(?:\.\d+)?)\D+)?([NSEW])')
+
     def __init__(self, name: str, lat: str, lon: str):
         self.name = name
-        self.lat = radians(Capital._convert(lat))
-        self.lon = radians(Capital._convert(lon))
-    
+        self.lat, self.lon = Capital.parse_coords(lat, lon)
+        self.cos_lat = cos(self.lat)
+
     def __str__(self):
         return f'{self.name} - ({self.lat}, {self.lon})'
 
     @staticmethod
-    def _convert(cord: str) -> float:
+    def parse_coords(lat: str, lon: str) -> tuple:
         '''
-            Convert provided string representing geograhpical location
-            to degrees
+            Parse both DMS coordinate strings of a capital in one regex
+            pass and return (lat, lon) in radians
         '''
-        positive = cord[-1] in ['N', 'E']
-        match = re.match(r'(\d+).(\d+).(\d+){0,1}.*', cord)
-        d, m, = float(match.group(1)), float(match.group(2))
-        tmp_s = match.group(2)
-        s = float(tmp_s) if tmp_s else 0
-        return (d + m / 60.0 + s / 3600.0) * (1 if positive else -1)
+        result = []
+        for d, m, s, direction in Capital._DMS_RE.findall(lat + ' ' + lon):
+            value = float(d) + float(m) / 60.0 + (float(s) if s else 0.0) / 3600.0
+            result.append(radians(value if direction in 'NE' else -value))
+        return result[0], result[1]
 
     def distance(self, other_city: 'Capital') -> float:
         '''
@@ -58,84 +91,466 @@ class Capital:
             Assume that earth radius is 6371km and it's a perfect sphere
             Returned distance is in kilometers (km)
         '''
-        lat_diff = other_city.lat - self.lat
-        lon_diff = other_city.lon - self.lon
-
-        earth_radius = 6371
-        a = sin(lat_diff / 2) ** 2 + cos(self.lat) * cos(other_city.lat) * (sin(lon_diff / 2) ** 2)
-        d = 2 * earth_radius * asin(sqrt(a))
+        d = _hav(self.lat, self.lon, self.cos_lat,
+                 other_city.lat, other_city.lon, other_city.cos_lat)
         return round(d)
 
-def download_capitals_list() -> list:
+# Lightweight per-capital view handed out by CapitalTable.__getitem__
+CapitalView = namedtuple('CapitalView', ['name', 'lat', 'lon', 'cos_lat'])
+
+class CapitalTable:
+    '''
+        Structure-of-arrays storage of all capitals: a list of names plus
+        contiguous arrays of latitudes and longitudes in radians. Bulk
+        consumers like the distance matrix read the arrays directly;
+        indexing returns a per-capital view for printing and 1-vs-1 queries
+    '''
+    __slots__ = ('names', 'lats', 'lons', '_D')
+
+    def __init__(self, names: list, lats: np.ndarray, lons: np.ndarray):
+        self.names = list(names)
+        # float32 keeps ~1 m positional precision, plenty for capital
+        # distances, at half the memory and twice the SIMD lanes
+        self.lats = np.asarray(lats, dtype=np.float32)
+        self.lons = np.asarray(lons, dtype=np.float32)
+        self._D = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, i: int) -> CapitalView:
+        lat = float(self.lats[i])
+        return CapitalView(self.names[i], lat, float(self.lons[i]), cos(lat))
+
+    def distance_matrix(self) -> np.ndarray:
+        '''
+            Full pairwise float32 distance matrix, built once on first use.
+            At N=35 capitals it is ~5 KB, so repeated pair queries become
+            plain array loads
+        '''
+        if self._D is None:
+            self._D = pairwise_haversine(self.lats, self.lons).astype(np.float32)
+        return self._D
+
+    def dist(self, i: int, j: int) -> float:
+        return float(self.distance_matrix()[i, j])
+
+def _download_capital_details(capital: tuple) -> Capital:
+    '''
+        Download the wikipedia article of a single capital and extract
+        its geographical coordinates
+    '''
+    capitalName, capitalLink = capital
+
+    r = _session.get('https://en.wikipedia.org' + capitalLink, stream=True, timeout=10)
+    if r.status_code != 200:
+        error(f'Failed to download capital details ({capitalLink}). Server returned:', r.status_code)
+        exit(1)
+
+    # Only two spans are needed from the whole page - query them straight
+    # on the lxml tree instead of building a BeautifulSoup object model.
+    # Feeding the raw stream lets the C tokenizer start before the whole
+    # body arrived and skips the Python-level decode of r.text
+    r.raw.decode_content = True
+    tree = lxml.html.parse(r.raw).getroot()
+    lat = tree.xpath('string(//span[@class="latitude"][1])')
+    lon = tree.xpath('string(//span[@class="longitude"][1])')
+    return Capital(capitalName, lat, lon)
+
+def download_capitals_list() -> CapitalTable:
     '''
         Download names and positiions of capitals of all countries located in
         both North and South America. Use wikipedia articles to gather necessary
-        information
+        information. Per-capital pages are fetched in parallel as the task is
+        purely network bound
     '''
-    result = []
-
-    r = requests.get('https://en.wikipedia.org/wiki/Americas')
+    r = _session.get('https://en.wikipedia.org/wiki/Americas', stream=True, timeout=10)
     if r.status_code != 200:
         error('Failed to download capitals list. Server returned:', r.status_code)
         exit(1)
-    
-    soup = BeautifulSoup(r.text, features="lxml")
-    table = soup.find_all('table', class_="sortable")[0]
+
+    # Only the countries table is needed from the whole page; the strainer
+    # makes the parser skip building objects for everything else, and the
+    # raw byte stream goes straight to lxml without decoding to str first
+    only_table = SoupStrainer('table', class_="sortable")
+    r.raw.decode_content = True
+    soup = BeautifulSoup(r.raw, features="lxml", parse_only=only_table)
+    table = soup.find('table', class_="sortable")
     rows = table.find_all('tr')
+
+    capitals_meta = []
     for row in rows:
         tds = row.find_all('td')
         if len(tds) < 6:
             continue
 
-        countryName = tds[0].find('a').text
-
-        if tds[5].find('a') == None:
+        country_link = tds[0].find('a')
+        if country_link is None:
             continue
-        capitalName = tds[5].find('a').text
-        capitalLink = tds[5].find('a')['href']
+        countryName = country_link.text
 
-        r = requests.get('https://en.wikipedia.org' + capitalLink)
-        if r.status_code != 200:
-            error(f'Failed to download capital details ({capitalLink}). Server returned:', r.status_code)
-            exit(1)
-        
-        subsoup = BeautifulSoup(r.text, features="lxml")
-        lat = subsoup.find_all('span', class_="latitude")[0].text
-        lon = subsoup.find_all('span', class_="longitude")[0].text
-        result += [Capital(capitalName, lat, lon)]
+        capital_link = tds[5].find('a')
+        if capital_link is None:
+            continue
+        capitals_meta += [(capital_link.text, capital_link['href'])]
 
-    return  result
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        downloaded = list(executor.map(_download_capital_details, capitals_meta))
+    return CapitalTable([c.name for c in downloaded],
+                        [c.lat for c in downloaded],
+                        [c.lon for c in downloaded])
 
-def get_capitals_list() -> list:
+def get_capitals_list() -> CapitalTable:
     '''
         Try to read capitals list from the locally cached file.
-        In case its missing, download list from the web using 
+        In case its missing, download list from the web using
         `download_capitals_list` function
     '''
+    path = 'resources/capitals.npz'
+    if os.path.exists(path):
+        # A corrupted cache now fails loudly instead of being silently
+        # swallowed and re-downloaded; delete the file to force a refresh
+        with np.load(path) as data:
+            return CapitalTable(data['names'].tolist(), data['lats'], data['lons'])
+
+    info('Downloading capitals list. This might take a while....')
+    capitals = download_capitals_list()
+    os.makedirs('resources', exist_ok=True)
+    np.savez(path, names=np.array(capitals.names), lats=capitals.lats, lons=capitals.lons)
+    return capitals
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _hav_matrix(lats, lons):
+    '''
+        Pairwise Haversine matrix computed row by row in compiled code;
+        prange spreads the rows over all cores without holding the GIL
+    '''
+    n = lats.shape[0]
+    out = np.empty((n, n), dtype=np.float64)
+    for i in prange(n):
+        cos_i = cos(lats[i])
+        for j in range(n):
+            s1 = sin((lats[j] - lats[i]) * 0.5)
+            s2 = sin((lons[j] - lons[i]) * 0.5)
+            a = s1 * s1 + cos_i * cos(lats[j]) * s2 * s2
+            out[i, j] = 12742.0 * asin(sqrt(a))
+    return out
+
+def pairwise_haversine(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    '''
+        Compute the matrix of Haversine distances between all pairs of
+        points given as arrays of radians. Returned distances are in
+        kilometers (km)
+    '''
+    return _hav_matrix(np.ascontiguousarray(lats, dtype=np.float64),
+                       np.ascontiguousarray(lons, dtype=np.float64))
+
+def get_distances_matrix(capitals: CapitalTable) -> np.ndarray:
+    '''
+        Compute the pairwise distance matrix of all capitals with a single
+        vectorized Haversine pass. The matrix is deterministic, so keep it
+        cached on disk and only recompute when it is older than the
+        capitals list it was derived from
+    '''
+    path = 'resources/distances.npy'
     try:
-        with open('resources/capitals.pkl', 'rb') as f:
-            return pickle.load(f)
-    except:
-        info('Downloading capitals list. This might take a while....')
-        capitals = download_capitals_list()
-        with open('resources/capitals.pkl', 'wb') as f:
-            pickle.dump(capitals, f)
-        return capitals
+        if os.path.getmtime(path) >= os.path.getmtime('resources/capitals.npz'):
+            cached = np.load(path)
+            if cached.dtype == np.uint16:
+                return cached
+    except OSError:
+        pass
+
+    # Distances are whole kilometers below 2^16, so uint16 halves the bytes
+    # moved per fitness evaluation compared to float32
+    distances = np.round(pairwise_haversine(capitals.lats, capitals.lons)).astype(np.uint16)
+
+    np.save(path, distances)
+    return distances
 
 
 ##############################
 # Genius AI implementation
 ##############################
 
+@njit(cache=True, fastmath=True)
+def tour_length(tour, D):
+    '''
+        Sum the lengths of all edges of a closed tour. Compiled by Numba
+        to avoid interpreter overhead in the GA fitness evaluation
+    '''
+    total = 0.0
+    for i in range(tour.shape[0] - 1):
+        total += D[tour[i], tour[i + 1]]
+    total += D[tour[-1], tour[0]]
+    return total
+
+@njit(parallel=True, fastmath=True)
+def all_lengths(tours, D):
+    '''
+        Evaluate the lengths of a whole population of tours (one per row)
+        in a single parallel kernel instead of one Python call per member
+    '''
+    out = np.empty(tours.shape[0], dtype=np.float32)
+    for p in prange(tours.shape[0]):
+        total = 0.0
+        for i in range(tours.shape[1] - 1):
+            total += D[tours[p, i], tours[p, i + 1]]
+        total += D[tours[p, -1], tours[p, 0]]
+        out[p] = total
+    return out
+
+@njit(cache=True)
+def nearest_neighbor_tour(D, start):
+    '''
+        Build a greedy tour always moving to the closest unvisited city.
+        Used to warm-start part of the initial GA population
+    '''
+    n = D.shape[0]
+    tour = np.empty(n, dtype=np.int32)
+    visited = np.zeros(n, dtype=np.uint8)
+    tour[0] = start
+    visited[start] = 1
+    for i in range(1, n):
+        prev = tour[i - 1]
+        best = -1
+        best_dist = np.inf
+        for j in range(n):
+            if visited[j] == 0 and D[prev, j] < best_dist:
+                best_dist = D[prev, j]
+                best = j
+        tour[i] = best
+        visited[best] = 1
+    return tour
+
+@njit(cache=True)
+def pmx_pair(p1, p2, pos1, pos2):
+    '''
+        Partially Mapped Crossover of two tours with cut points pos1..pos2.
+        The dict-based mapping chase is replaced by inverse lookup arrays
+        walked in compiled code
+    '''
+    n = p1.shape[0]
+    c1 = p1.copy()
+    c2 = p2.copy()
+    c1[pos1:pos2 + 1] = p2[pos1:pos2 + 1]
+    c2[pos1:pos2 + 1] = p1[pos1:pos2 + 1]
+
+    map12 = np.full(n, -1, dtype=np.int32)
+    map21 = np.full(n, -1, dtype=np.int32)
+    for i in range(pos1, pos2 + 1):
+        map12[p1[i]] = p2[i]
+        map21[p2[i]] = p1[i]
+
+    for i in range(n):
+        if pos1 <= i <= pos2:
+            continue
+        x = p1[i]
+        while map21[x] != -1:
+            x = map21[x]
+        c1[i] = x
+        x = p2[i]
+        while map12[x] != -1:
+            x = map12[x]
+        c2[i] = x
+    return c1, c2
+
+@njit(cache=True)
+def ox_pair(p1, p2, pos1, pos2):
+    '''
+        Order Crossover: each child keeps its parent's pos1..pos2 slice and
+        takes the remaining cities in the order they appear in the other
+        parent, starting right after the slice
+    '''
+    n = p1.shape[0]
+    c1 = p1.copy()
+    c2 = p2.copy()
+
+    in_mid1 = np.zeros(n, dtype=np.uint8)
+    in_mid2 = np.zeros(n, dtype=np.uint8)
+    for i in range(pos1, pos2 + 1):
+        in_mid1[p1[i]] = 1
+        in_mid2[p2[i]] = 1
+
+    src1 = pos2 + 1
+    src2 = pos2 + 1
+    for k in range(n - (pos2 - pos1 + 1)):
+        pos = (pos2 + 1 + k) % n
+        while in_mid1[p2[src1 % n]] == 1:
+            src1 += 1
+        c1[pos] = p2[src1 % n]
+        src1 += 1
+        while in_mid2[p1[src2 % n]] == 1:
+            src2 += 1
+        c2[pos] = p1[src2 % n]
+        src2 += 1
+    return c1, c2
+
+@njit(cache=True)
+def cx_pair(p1, p2):
+    '''
+        Cycle Crossover: follow the cycle starting at position 0, keep it
+        from the own parent and take everything else from the other one
+    '''
+    n = p1.shape[0]
+    inv1 = np.empty(n, dtype=np.int32)
+    inv2 = np.empty(n, dtype=np.int32)
+    for i in range(n):
+        inv1[p1[i]] = i
+        inv2[p2[i]] = i
+
+    c1 = np.full(n, -1, dtype=np.int32)
+    c1[0] = p1[0]
+    index = 0
+    while True:
+        value = p2[index]
+        index = inv1[value]
+        if value == p1[0]:
+            break
+        c1[index] = value
+    for i in range(n):
+        if c1[i] == -1:
+            c1[i] = p2[i]
+
+    c2 = np.full(n, -1, dtype=np.int32)
+    c2[0] = p2[0]
+    index = 0
+    while True:
+        value = p1[index]
+        index = inv2[value]
+        if value == p2[0]:
+            break
+        c2[index] = value
+    for i in range(n):
+        if c2[i] == -1:
+            c2[i] = p1[i]
+    return c1, c2
+
+@njit(parallel=True)
+def crossover_batch(elites, out, positions, algorithm):
+    '''
+        Cross every ordered pair of elite tours in parallel, writing the two
+        children of pair number p into rows 2p and 2p+1 of the out buffer.
+        positions holds the pre-drawn cut points of each pair
+    '''
+    k = elites.shape[0]
+    for pair in prange(k * k):
+        a = pair // k
+        b = pair % k
+        pos1 = positions[pair, 0]
+        pos2 = positions[pair, 1]
+        if algorithm == 0:
+            c1, c2 = pmx_pair(elites[a], elites[b], pos1, pos2)
+        elif algorithm == 1:
+            c1, c2 = ox_pair(elites[a], elites[b], pos1, pos2)
+        else:
+            c1, c2 = cx_pair(elites[a], elites[b])
+        out[2 * pair] = c1
+        out[2 * pair + 1] = c2
+
+@njit(cache=True)
+def mutate_2opt_batch(tours, lengths, mask, positions, D):
+    '''
+        Apply a 2-opt reversal to every tour row selected by mask, patching
+        the matching entry of lengths in place with the two-edge delta
+    '''
+    n = tours.shape[1]
+    for p in range(tours.shape[0]):
+        if not mask[p]:
+            continue
+        pos1 = positions[p, 0]
+        pos2 = positions[p, 1]
+        if pos1 > pos2:
+            pos1, pos2 = pos2, pos1
+        prev = (pos1 - 1) % n
+        nxt = (pos2 + 1) % n
+        if prev != pos2:
+            # Promote to float before subtracting - the matrix is unsigned
+            old = np.float32(D[tours[p, prev], tours[p, pos1]]) + np.float32(D[tours[p, pos2], tours[p, nxt]])
+            new = np.float32(D[tours[p, prev], tours[p, pos2]]) + np.float32(D[tours[p, pos1], tours[p, nxt]])
+            lengths[p] += new - old
+        lo, hi = pos1, pos2
+        while lo < hi:
+            tmp = tours[p, lo]
+            tours[p, lo] = tours[p, hi]
+            tours[p, hi] = tmp
+            lo += 1
+            hi -= 1
+
+@njit(cache=True)
+def run_generations(buf, lengths, D, generations_count, mutation_factor, k, population_size, algorithm, seed):
+    '''
+        The whole GA generation loop compiled as a single kernel:
+        reproduction, evaluation, selection and mutation run back to back
+        without returning to the interpreter in between. buf must hold the
+        initial population in its first population_size rows; returns the
+        recorded best lengths per generation
+    '''
+    np.random.seed(seed)
+    N = buf.shape[1]
+    bests = np.empty(generations_count + 1, dtype=np.float32)
+    scratch = np.empty((population_size, N), dtype=np.int32)
+    scratch_lengths = np.empty(population_size, dtype=np.float32)
+    positions = np.empty((k * k, 2), dtype=np.int64)
+    mutate_mask = np.empty(population_size, dtype=np.bool_)
+    mutate_positions = np.empty((population_size, 2), dtype=np.int64)
+
+    # Generation 0
+    pop_count = population_size
+    lengths[:pop_count] = all_lengths(buf[:pop_count], D)
+    order = np.argsort(lengths[:pop_count])
+    for i in range(pop_count):
+        scratch[i] = buf[order[i]]
+        scratch_lengths[i] = lengths[order[i]]
+    buf[:pop_count] = scratch[:pop_count]
+    lengths[:pop_count] = scratch_lengths[:pop_count]
+    bests[0] = lengths[pop_count - 1]
+
+    for generation in range(generations_count):
+        # Reproduce best members
+        for p in range(k * k):
+            positions[p, 0] = np.random.randint(0, N - 1)
+            positions[p, 1] = np.random.randint(positions[p, 0], N)
+        children = buf[pop_count:pop_count + 2 * k * k]
+        crossover_batch(buf[:k], children, positions, algorithm)
+        lengths[pop_count:pop_count + 2 * k * k] = all_lengths(children, D)
+
+        # Keep the shortest tours of population + children
+        merged_count = pop_count + 2 * k * k
+        pop_count = population_size - 1
+        order = np.argsort(lengths[:merged_count])
+        for i in range(pop_count):
+            scratch[i] = buf[order[i]]
+            scratch_lengths[i] = lengths[order[i]]
+        buf[:pop_count] = scratch[:pop_count]
+        lengths[:pop_count] = scratch_lengths[:pop_count]
+
+        # Apply mutation for the population members
+        for p in range(pop_count):
+            mutate_mask[p] = np.random.random() < mutation_factor
+            mutate_positions[p, 0] = np.random.randint(0, N)
+            mutate_positions[p, 1] = np.random.randint(0, N)
+        mutate_2opt_batch(buf[:pop_count], lengths[:pop_count], mutate_mask[:pop_count], mutate_positions[:pop_count], D)
+
+        # Record best member
+        bests[generation + 1] = lengths[pop_count - 1]
+
+    return bests
+
 class Path:
+    __slots__ = ('vertices', '_cached_length')
+
     def __init__(self, length: int, vertices=None):
-        if not vertices:
-            self.vertices = [i for i in range(length)]
-            random.shuffle(self.vertices)
-        else:
-            self.vertices = vertices
+        if vertices is None:
+            vertices = [i for i in range(length)]
+            random.shuffle(vertices)
+        self.vertices = np.asarray(vertices, dtype=np.int32)
+        self._cached_length = None
+        # Validate the permutation once at construction; the reproduce_*
+        # methods keep it valid afterwards. Skipped when run with -O
+        assert self.isValid()
+
 
-    
     def isValid(self) -> bool:
         '''
             Check if each verticle is present only once in vector
@@ -147,189 +562,106 @@ class Path:
             return True
 
     def length(self) -> float:
-        total = 0.0
-        for i in range(len(self.vertices) - 1):
-            total += distances[(self.vertices[i], self.vertices[i+1])]
-        total += distances[(self.vertices[-1], self.vertices[0])]
-        return total if self.isValid() else 0.0
+        if self._cached_length is None:
+            self._cached_length = tour_length(self.vertices, distances)
+        return self._cached_length
     
     # Mutations
-    def mutate_swap(self):
-        pos1 = random.randint(0, len(self.vertices) - 1)
-        pos2 = random.randint(0, len(self.vertices) - 1)
+    def mutate_swap(self, pos1=None, pos2=None):
+        if pos1 is None:
+            pos1 = random.randint(0, len(self.vertices) - 1)
+        if pos2 is None:
+            pos2 = random.randint(0, len(self.vertices) - 1)
+
+        if self._cached_length is None:
+            self.vertices[pos1], self.vertices[pos2] = self.vertices[pos2], self.vertices[pos1]
+            return
+
+        # Only the edges touching the swapped positions change, so update the
+        # cached length with an O(1) delta instead of a full recomputation.
+        # Keeping the edges in a set handles wraparound and adjacent swaps
+        # sharing an edge
+        n = len(self.vertices)
+        edges = {(pos1 - 1) % n, pos1, (pos2 - 1) % n, pos2}
+        old = sum(float(distances[self.vertices[e], self.vertices[(e + 1) % n]]) for e in edges)
         self.vertices[pos1], self.vertices[pos2] = self.vertices[pos2], self.vertices[pos1]
+        new = sum(float(distances[self.vertices[e], self.vertices[(e + 1) % n]]) for e in edges)
+        self._cached_length += new - old
+
+    def mutate_2opt(self, pos1=None, pos2=None):
+        '''
+            Reverse the segment between two cut points (2-opt move). Much
+            stronger than a plain swap: it removes two edge crossings at
+            once while still allowing an O(1) length update
+        '''
+        if pos1 is None:
+            pos1 = random.randint(0, len(self.vertices) - 2)
+        if pos2 is None:
+            pos2 = random.randint(pos1 + 1, len(self.vertices) - 1)
+        if pos1 > pos2:
+            pos1, pos2 = pos2, pos1
+
+        n = len(self.vertices)
+        prev = (pos1 - 1) % n
+        nxt = (pos2 + 1) % n
+        if self._cached_length is not None and prev != pos2:
+            # The reversal replaces exactly two edges of the closed tour;
+            # the reversed inner edges keep their length (symmetric matrix)
+            v = self.vertices
+            old = float(distances[v[prev], v[pos1]]) + float(distances[v[pos2], v[nxt]])
+            new = float(distances[v[prev], v[pos2]]) + float(distances[v[pos1], v[nxt]])
+            self._cached_length += new - old
+        self.vertices[pos1:pos2 + 1] = self.vertices[pos1:pos2 + 1][::-1]
 
     # Reproductions
     def reproduce_pmx(self, parent2: 'Path') -> tuple:
         pos1 = random.randint(0, len(self.vertices) - 2)
         pos2 = random.randint(pos1, len(self.vertices) - 1)
-
-        t1, t2 = {}, {}
-        for i in range(pos1, pos2 + 1): # create mappings
-            t1[self.vertices[i]] = parent2.vertices[i]
-            t2[parent2.vertices[i]] = self.vertices[i]
-
-        child1, child2 = [], []
-
-        def pos_filler(i):
-            def key_finder(what, where):
-                key = what
-                while key in where:
-                    key = where[key]
-                return key
-
-            p1 = self.vertices[i]
-            p2 = parent2.vertices[i]
-
-            if p1 in t2:
-                child1.append(key_finder(p1, t2))
-            else:
-                child1.append(self.vertices[i])
-            if p2 in t1:
-                child2.append(key_finder(p2, t1))
-            else:
-                child2.append(parent2.vertices[i])
-
-        # Left part
-        for idx in range(0, pos1):
-            pos_filler(idx)
-
-        # Middle part - swap it
-        for i in range(pos1, pos2 + 1):
-            child1.append(parent2.vertices[i])
-            child2.append(self.vertices[i])
-        
-        # Right part - the same as left part
-        for idx in range(pos2 + 1, len(self.vertices)):
-            pos_filler(idx)
-
+        child1, child2 = pmx_pair(self.vertices, parent2.vertices, pos1, pos2)
         return Path(0, child1), Path(0, child2)
 
     def reproduce_ox(self, parent2: 'Path') -> tuple:
         pos1 = random.randint(0, len(self.vertices) - 2)
         pos2 = random.randint(pos1, len(self.vertices) - 1)
-
-        t1, t2 = self.vertices.copy(), parent2.vertices.copy()
-        for i in range(len(t1)):
-            for j in range(pos1, pos2 + 1):
-                if t1[i] == parent2.vertices[j]:
-                    t1[i] = -1
-                if t2[i] == self.vertices[j]:
-                    t2[i] = -1
-        
-        def pop_append(data, shift):
-            for _ in range(shift):
-                data.append(data.pop(0))
-            return data
-        
-        t1 = pop_append(t1, pos2 + 1)
-        t2 = pop_append(t2, pos2 + 1)
-        
-        child1, child2 = self.vertices.copy(), parent2.vertices.copy()
-
-        # Right part
-        for i in range(pos2 + 1, len(self.vertices)):
-            x = -1
-            while x == -1:
-                x = t2.pop(0)
-            child1[i] = x
-
-            x = -1
-            while x == -1:
-                x = t1.pop(0)
-            child2[i] = x
-
-        # Left part
-        for i in range(0, pos1):
-            x = -1
-            while x == -1:
-                x = t2.pop(0)
-            child1[i] = x
-
-            x = -1
-            while x == -1:
-                x = t1.pop(0)
-            child2[i] = x
-
-        # Middle part - already done
-
+        child1, child2 = ox_pair(self.vertices, parent2.vertices, pos1, pos2)
         return Path(0, child1), Path(0, child2)
 
     def reproduce_cx(self, parent2: 'Path') -> tuple:
-        # First offspring
-        child1 = [-1] * len(self.vertices)         
-        first_city = self.vertices[0]
-        child1[0] = first_city
-        index = 0
-        while True: # first part of algorithm
-            second_parent_value = parent2.vertices[index]
-            index = self.vertices.index(second_parent_value)
-            if second_parent_value == first_city:
-                break
-            child1[index] = second_parent_value
-        for i in range(len(child1)): # second part
-            if child1[i] == -1:
-                child1[i] = parent2.vertices[i]
-
-        # Second offspring 
-        child2 = [-1] * len(parent2.vertices)         
-        first_city = parent2.vertices[0]
-        child2[0] = first_city
-        index = 0
-        while True: # first part of algorithm
-            second_parent_value = self.vertices[index]
-            index = parent2.vertices.index(second_parent_value)
-            if second_parent_value == first_city:
-                break
-            child2[index] = second_parent_value
-        for i in range(len(child2)): # second part
-            if child2[i] == -1:
-                child2[i] = self.vertices[i]
-
+        child1, child2 = cx_pair(self.vertices, parent2.vertices)
         return Path(0, child1), Path(0, child2)
 
 def ai_main(population_size: int, generations_count: int, mutation_factor: float, algorithm: int):
-    bests = []
-    logn_population_size = int(round(sqrt(population_size) + 1))
-
-    population = [Path(len(capitals)) for _ in range(population_size)]
-    # Generation 0
-    population = sorted(population, key=lambda x: x.length())
-    best_member = population[-1]
-    bests.append(best_member.length())
-    for generation in range(generations_count):        
-        # Reproduce best members
-        best_part_population = population[:logn_population_size]
-        new_population = []
-        for A in best_part_population:
-            for B in best_part_population:
-                if algorithm == 0:
-                    child1, child2 = A.reproduce_pmx(B)
-                elif algorithm == 1:
-                    child1, child2 = A.reproduce_ox(B)
-                elif algorithm == 2:
-                    child1, child2 = A.reproduce_cx(B)
-                else:
-                    error('Invalid algorithm code!')
-                    exit(1)
-                new_population.append(child1)
-                new_population.append(child2)
-        
-        population = population + new_population
-        population = sorted(population, key=lambda x: x.length())
-        population = population[:population_size-1]
-
-        # Apply mutation for the population members
-        for i in range(len(population)):
-            if mutation_factor > random.uniform(0, 1):
-                population[i].mutate_swap()
-
-        best_member = population[-1]
+    if algorithm not in (0, 1, 2):
+        error('Invalid algorithm code!')
+        exit(1)
 
-        # Record best member
-        bests.append(best_member.length())
-    
-    info('Lowest score found:', min(bests))
+    logn_population_size = int(round(sqrt(population_size) + 1))
+    rng = np.random.default_rng()
+
+    N = len(capitals)
+    k = logn_population_size
+
+    # The whole run works on one preallocated buffer: the first rows hold
+    # the current population, the following ones receive the children of a
+    # generation
+    buf = np.empty((population_size + 2 * k * k, N), dtype=np.int32)
+    lengths = np.empty(population_size + 2 * k * k, dtype=np.float32)
+
+    # Seed part of the initial population with nearest-neighbour tours from
+    # different starting cities; the remaining members stay fully random
+    nn_count = min(max(population_size // 4, 1), N)
+    starts = rng.choice(N, size=nn_count, replace=False)
+    for i, start in enumerate(starts):
+        buf[i] = nearest_neighbor_tour(distances, int(start))
+    for i in range(nn_count, population_size):
+        buf[i] = rng.permutation(N)
+
+    # The complete generation loop runs inside one compiled kernel
+    seed = int(rng.integers(2 ** 31 - 1))
+    bests = run_generations(buf, lengths, distances, generations_count,
+                            mutation_factor, k, population_size, algorithm, seed)
+
+    info('Lowest score found:', float(bests.min()))
     plt.scatter(range(generations_count+1), bests, s=1)
     plt.show()
 
@@ -348,10 +680,7 @@ if __name__ == '__main__':
     capitals = get_capitals_list()
     info(f'Loaded {len(capitals)} capitals')
 
-    distances = {}
-    for i, A in enumerate(capitals):
-        for j, B in enumerate(capitals):
-            distances[(i, j)] = A.distance(B)
+    distances = get_distances_matrix(capitals)
 
     ai_main(args.population_size, args.generations_count, args.mutation_factor, args.algorithm)
 